@@ -126,20 +126,24 @@ class EpiDesign(list):
         return self.boundaries()[-1]
 
     def _ind_dx(self, x):
-        if x == 0:
-            return 0, 0.0
-        xi = 0.0
-        for i, layer in enumerate(self):
-            if x <= (xi + layer.dx):
-                return i, x - xi
-            xi += layer.dx
-        return np.nan, np.nan
+        # binary search, same intervals as in `_inds_dx`
+        bnds = self.boundaries()
+        i = int(np.searchsorted(bnds[1:], x, side='left'))
+        if i == len(self):
+            return np.nan, np.nan
+        return i, x - bnds[i]
 
     def _inds_dx(self, x):
-        inds = np.zeros_like(x)
-        dx = np.zeros_like(x)
-        for i, xi in enumerate(x):
-            inds[i], dx[i] = self._ind_dx(xi)
+        # layer `i` spans (bnds[i], bnds[i+1]], first layer also includes 0
+        x = np.asarray(x)
+        bnds = self.boundaries()
+        i = np.searchsorted(bnds[1:], x, side='left')
+        outside = (i == len(self))
+        i[outside] = 0
+        inds = i.astype(x.dtype)
+        dx = x - bnds[i]
+        inds[outside] = np.nan
+        dx[outside] = np.nan
         return inds, dx
 
     def calculate(self, param, x, inds=None, dx=None):
@@ -9,9 +9,8 @@ identical vertical slices are connected via stimulated emission.
 import warnings
 import os
 import numpy as np
-from scipy.interpolate import interp1d
-from scipy.linalg import solve_banded
-from scipy import sparse
+from scipy.linalg.lapack import dgtsv
+from scipy import sparse, signal
 import design
 import constants as const
 import units
@@ -28,6 +27,10 @@ yin_params = ['Ev', 'Ec', 'Eg', 'Nd', 'Na', 'C_dop', 'Nc', 'Nv', 'mu_n',
               'mu_p', 'tau_n', 'tau_p', 'B', 'Cn', 'Cp', 'eps', 'n_refr',
               'g0', 'N_tr', 'fca_e', 'fca_h']
 ybn_params = ['Ev', 'Ec', 'Nc', 'Nv', 'mu_n', 'mu_p']
+# parameters defined at every node, stored as rows of a 2D array
+yin_mat_params = [p for p in yin_params if p not in design.params_active]
+yin_mat_units = np.array([units.dct[p] for p in yin_mat_params])
+ybn_mat_units = np.array([units.dct[p] for p in ybn_params])
 
 
 class LaserDiode(object):
@@ -98,7 +101,9 @@ class LaserDiode(object):
 
         # parameters at mesh nodes
         self.yin = dict()  # values at interior nodes
+        self._yin_mat = np.empty((len(yin_mat_params), 0))  # `yin` rows
         self.ybn = dict()  # values at boundary nodes
+        self._ybn_mat = np.empty((len(ybn_params), 0))  # `ybn` rows
         self.sol = dict()  # current solution (potentials and concentrations)
         self.sol['S'] = 1e-12  # essentially 0
 
@@ -129,6 +134,7 @@ class LaserDiode(object):
         self.xin = np.arange(0, d, step)
         self.xbn = (self.xin[1:]+self.xin[:-1]) / 2
         self.nx = len(self.xin)  # number of grid nodes
+        self._lookup = dict()  # layer indices of mesh nodes
         self.ar_ix = self._get_ar_ix()
         if calc_params:
             self.calc_all_params()
@@ -180,43 +186,43 @@ class LaserDiode(object):
 
         # function for choosing local step size
         f = np.abs(y_ext[2:]-y_ext[:-2])  # change of y at every point
-        fg = np.zeros_like(f)  # convolution for smoothing
-        for i, xi in enumerate(x):
-            g = gauss(x, xi, sigma)
-            fg[i] = np.sum(f*g)
-        fg_fun = interp1d(x, fg/fg.max())
+        # convolution for smoothing, `x` is uniform -> single kernel
+        # spanning all possible node offsets, computed with FFT
+        dx = x - x[0]
+        g = gauss(np.concatenate([-dx[:0:-1], dx]), 0, sigma)
+        fg = signal.fftconvolve(f, g, mode='valid')
+        h = step_min + (step_max - step_min)*(1 - fg/fg.max())  # local step
 
         # generating new grid
-        k = step_max - step_min
-        new_grid = list()
-        xi = 0
-        while xi <= x[-1]:
-            new_grid.append(xi)
-            xi += step_min + k*(1 - fg_fun(xi))
-        self.xin = np.array(new_grid)
+        # node density is 1/h -> place nodes at integer values of
+        # its cumulative integral (number of nodes to the left of x)
+        s = np.concatenate([[0.0], np.cumsum((1/h[1:] + 1/h[:-1]) / 2
+                                            * np.diff(x))])
+        self.xin = np.interp(np.arange(0, s[-1]), s, x)
         self.xbn = (self.xin[1:] + self.xin[:-1]) / 2
         self.nx = len(self.xin)
+        self._lookup = dict()
         self.ar_ix = self._get_ar_ix()
         self.calc_all_params()
 
         # return grid nodes, values of `param` at grid nodes
         # and function values used to determine local step
-        return x, y, step_min + k*(1 - fg_fun(x))
+        return x, y, h
 
     def calc_all_params(self):
         "Calculate all parameters' values at mesh nodes."
-        inds, dx = self.epi._inds_dx(self.xin)
-        for p in yin_params:
-            if p in design.params_active:
-                continue
-            self._calculate_param(p, 'i', inds, dx)
-        inds, dx = inds[self.ar_ix], dx[self.ar_ix]
+        self._yin_mat = np.empty((len(yin_mat_params), self.nx))
+        for i, p in enumerate(yin_mat_params):
+            self._calculate_param(p, 'i')
+            self._yin_mat[i] = self.yin[p]
+            self.yin[p] = self._yin_mat[i]
         for p in design.params_active:
-            self._calculate_param(p, 'i', inds, dx)
-        inds, dx = self.epi._inds_dx(self.xbn)
-        for p in ybn_params:
-            inds, dx = self.epi._inds_dx(self.xbn)
-            self._calculate_param(p, 'b', inds, dx)
+            self._calculate_param(p, 'i')
+        self._ybn_mat = np.empty((len(ybn_params), self.nx - 1))
+        for i, p in enumerate(ybn_params):
+            self._calculate_param(p, 'b')
+            self._ybn_mat[i] = self.ybn[p]
+            self.ybn[p] = self._ybn_mat[i]
         if self.n_eff is not None:  # waveguide problem has been solved
             self._calc_wg_mode()
 
@@ -232,7 +238,7 @@ class LaserDiode(object):
             Which mesh nodes -- `internal` (`i`) or `boundary` (`b`) -- should
             the values be calculated at. The default is 'internal'.
         inds : numpy.ndarray or None
-            Layer index for each node.
+            Layer index for each node. Looked up (once per mesh) if `None`.
         dx : numpy.ndarray or None
             Distance from layer left boundary for each node.
 
@@ -248,32 +254,49 @@ class LaserDiode(object):
             assert nodes in ('i', 'internal')
             x = self.xin[self.ar_ix]
             d = self.yin
+            key = 'i'
         elif p not in design.params:
             raise Exception('Error: unknown parameter %s' % p)
         else:
             if nodes == 'internal' or nodes == 'i':
                 x = self.xin
                 d = self.yin
+                key = 'i'
             elif nodes == 'boundary' or nodes == 'b':
                 x = self.xbn
                 d = self.ybn
+                key = 'b'
 
         # calculating values
+        if inds is None or dx is None:
+            inds, dx = self._layer_lookup(key)
+            if p in design.params_active:
+                inds, dx = inds[self.ar_ix], dx[self.ar_ix]
         y = self.epi.calculate(p, x, inds, dx)
         d[p] = y  # modifies self.yin or self.ybn
 
+    def _layer_lookup(self, nodes):
+        """
+        Layer indices and distances from layer left boundaries for internal
+        (`'i'`) or boundary (`'b'`) mesh nodes. Calculated once per mesh.
+        """
+        if nodes not in self._lookup:
+            x = self.xin if nodes == 'i' else self.xbn
+            self._lookup[nodes] = self.epi._inds_dx(x)
+        return self._lookup[nodes]
+
     def _get_ar_ix(self, x=None, epi=None):
         "Mask for x, where elements belong to active region."
-        if x is None:
-            x = self.xin
         if epi is None:
             epi = self.epi
-        bnds = epi.boundaries()
-        ar_ix = np.zeros_like(x, dtype=bool)
+        if x is None and epi is self.epi:  # current mesh
+            inds, _ = self._layer_lookup('i')
+        else:
+            if x is None:
+                x = self.xin
+            inds, _ = epi._inds_dx(x)
         ar_inds = [i for i, lr in enumerate(epi) if lr.active]
-        for ind in ar_inds:
-            ar_ix |= np.logical_and(x > bnds[ind], x <= bnds[ind+1])
-        return ar_ix
+        return np.isin(inds, ar_inds)
 
     def make_dimensionless(self):
         "Make every parameter dimensionless."
@@ -302,10 +325,15 @@ class LaserDiode(object):
         self.dz /= units.x
 
         # arrays
-        for key in self.yin:
-            self.yin[key] /= units.dct[key]
-        for key in self.ybn:
-            self.ybn[key] /= units.dct[key]
+        # all values are arrays -> modified in place
+        self._yin_mat /= yin_mat_units[:, None]
+        for key, arr in self.yin.items():
+            if arr.base is not self._yin_mat:  # not scaled yet
+                arr /= units.dct[key]
+        self._ybn_mat /= ybn_mat_units[:, None]
+        for key, arr in self.ybn.items():
+            if arr.base is not self._ybn_mat:
+                arr /= units.dct[key]
         if self.ndim == 1:
             solutions = [self.sol]
         else:
@@ -345,10 +373,15 @@ class LaserDiode(object):
         self.dz *= units.x
 
         # arrays
-        for key in self.yin:
-            self.yin[key] *= units.dct[key]
-        for key in self.ybn:
-            self.ybn[key] *= units.dct[key]
+        # all values are arrays -> modified in place
+        self._yin_mat *= yin_mat_units[:, None]
+        for key, arr in self.yin.items():
+            if arr.base is not self._yin_mat:  # not scaled yet
+                arr *= units.dct[key]
+        self._ybn_mat *= ybn_mat_units[:, None]
+        for key, arr in self.ybn.items():
+            if arr.base is not self._ybn_mat:
+                arr *= units.dct[key]
         if self.ndim == 1:
             solutions = [self.sol]
         else:
@@ -487,23 +520,46 @@ class LaserDiode(object):
         h = self.xin[1:]-self.xin[:-1]
         w = self.xbn[1:]-self.xbn[:-1]
 
+        # `NewtonSolver` evaluates `res` and `jac` at the same `psi`,
+        # so carrier densities are calculated once per iteration
+        last = dict()
+
+        def densities(psi):
+            if 'psi' not in last or not np.array_equal(psi, last['psi']):
+                last['psi'] = psi.copy()
+                last['n'] = cc.n(psi, 0, self.yin['Nc'], self.yin['Ec'],
+                                 self.Vt)
+                last['p'] = cc.p(psi, 0, self.yin['Nv'], self.yin['Ev'],
+                                 self.Vt)
+            return last['n'], last['p']
+
         def res(psi):
-            n = cc.n(psi, 0, self.yin['Nc'], self.yin['Ec'], self.Vt)
-            p = cc.p(psi, 0, self.yin['Nv'], self.yin['Ev'], self.Vt)
+            n, p = densities(psi)
             r = eq.poisson_res(psi, n, p, h, w, self.yin['eps'], self.eps_0,
                                self.q, self.yin['C_dop'])
             return r
 
         def jac(psi):
-            n = cc.n(psi, 0, self.yin['Nc'], self.yin['Ec'], self.Vt)
+            n, p = densities(psi)
             ndot = cc.dn_dpsi(psi, 0, self.yin['Nc'], self.yin['Ec'], self.Vt)
-            p = cc.p(psi, 0, self.yin['Nv'], self.yin['Ev'], self.Vt)
             pdot = cc.dp_dpsi(psi, 0, self.yin['Nv'], self.yin['Ev'], self.Vt)
             j = eq.poisson_jac(psi, n, ndot, p, pdot, h, w, self.yin['eps'],
                                 self.eps_0, self.q, self.yin['C_dop'])
             return j
 
-        la_fun = lambda A, b: solve_banded((1,1), A, b)
+        # Jacobian is tridiagonal -> LAPACK `gtsv` on its diagonals
+        # `A` is kept by the solver (`NewtonSolver.jac`), while `b` is
+        # a temporary and can be overwritten
+        def la_fun(A, b):
+            x, info = dgtsv(A[2, :-1], A[1], A[0, 1:], b,
+                            overwrite_b=True)[3:]
+            if info > 0:
+                raise np.linalg.LinAlgError('singular matrix')
+            if info < 0:
+                raise ValueError('illegal value in %d-th argument of '
+                                 'internal gtsv' % -info)
+            return x
+
         psi_init = self.yin['psi_lcn']
         sol = newton.NewtonSolver(res, jac, psi_init, la_fun,
                                   inds=np.arange(1, len(psi_init)-1))
@@ -560,10 +616,12 @@ class LaserDiode(object):
             sol['n'] = cc.n(psi, phi_n, Nc, Ec, Vt)
             sol['p'] = cc.p(psi, phi_p, Nv, Ev, Vt)
             # derivatives
+            # dn/dphi_n = -dn/dpsi and dp/dphi_p = -dp/dpsi, no need
+            # to evaluate Fermi-Dirac integral derivatives twice
             sol['dn_dpsi'] = cc.dn_dpsi(psi, phi_n, Nc, Ec, Vt)
-            sol['dn_dphin'] = cc.dn_dphin(psi, phi_n, Nc, Ec, Vt)
+            sol['dn_dphin'] = -sol['dn_dpsi']
             sol['dp_dpsi'] = cc.dp_dpsi(psi, phi_p, Nv, Ev, Vt)
-            sol['dp_dphip'] = cc.dp_dphip(psi, phi_p, Nv, Ev, Vt)
+            sol['dp_dphip'] = -sol['dp_dpsi']
 
     # waveguide problem
     def solve_waveguide(self, step=1e-7, n_modes=3, remove_layers=(0, 0)):
@@ -596,8 +654,9 @@ class LaserDiode(object):
 
         # generating refractive index profile
         x = x0 + np.arange(0, epi.get_thickness(), step)[1:]
-        n = self.epi.calculate('n_refr', x)
-        ar_ix = self._get_ar_ix(x, self.epi)
+        inds, dx = self.epi._inds_dx(x)  # single lookup for `n` and `ar_ix`
+        n = self.epi.calculate('n_refr', x, inds, dx)
+        ar_ix = np.isin(inds, self.ar_inds)
 
         # solving the eigenvalue problem
         if self.is_dimensionless:
@@ -606,20 +665,18 @@ class LaserDiode(object):
             lam = self.lam
         n_eff_values, modes = waveguide.solve_wg(x, n, lam, n_modes)
         # and picking one mode with the largest confinement factor (Gamma)
-        gammas = np.zeros(n_modes)
-        for i in range(n_modes):
-            mode = modes[:, i]
-            gammas[i] = (mode*step)[ar_ix].sum()  # modes are normalized
+        gammas = modes[ar_ix].sum(axis=0) * step  # modes are normalized
         i = np.argmax(gammas)
-        mode = modes[:, i]
+        mode = modes[:, i].copy()
 
         # storing results
         self.n_eff = n_eff_values[i]
         self.gamma = gammas[i]
-        self.wgm_fun = interp1d(x, mode, bounds_error=False,
-                                fill_value=0)
-        self.wgm_fun_dls = interp1d(x/units.x, mode*units.x,
-                                    bounds_error=False, fill_value=0)
+        # linear interpolation, mode is zero outside of `x`
+        x_dls, mode_dls = x / units.x, mode * units.x
+        self.wgm_fun = lambda xq: np.interp(xq, x, mode, left=0.0, right=0.0)
+        self.wgm_fun_dls = lambda xq: np.interp(xq, x_dls, mode_dls,
+                                                left=0.0, right=0.0)
         self._calc_wg_mode()
 
         # return calculated mode profiles
@@ -7,8 +7,8 @@ import numpy as np
 
 def l2_norm(x):
     "Calculate L2 (Euclidean) norm of vector `x`."
-    x = np.asarray(x)
-    return np.sqrt(np.sum(x*x))
+    x = np.asarray(x).ravel()
+    return np.sqrt(np.dot(x, x))
 
 class NewtonSolver(object):
 
@@ -3,13 +3,23 @@
 1D waveguide equation.
 """
 
+import hashlib
 import numpy as np
 from scipy.sparse import diags
 from scipy.sparse.linalg import eigs
 
+_cache = dict()  # previously calculated solutions
+_cache_maxsize = 16
+
+def _digest(a):
+    "Hash of array `a` values."
+    a = np.ascontiguousarray(a, dtype=np.float64)
+    return hashlib.blake2b(a).digest()
+
 def solve_wg(x, n, lam, n_modes):
     """
-    Solve eigenvalue problem for a 1D waveguide.
+    Solve eigenvalue problem for a 1D waveguide. Results are cached, so
+    repeated calls with identical arguments do not solve the problem again.
 
     Parameters
     ----------
@@ -30,6 +40,11 @@ def solve_wg(x, n, lam, n_modes):
         Calculated mode profiles.
 
     """
+    key = (_digest(x), _digest(n), float(lam), int(n_modes))
+    if key in _cache:
+        n_eff, modes = _cache[key]
+        return n_eff.copy(), modes.copy()
+
     # creating matrix A for the eigenvalue problem
     k0 = 2*np.pi / lam
     delta_x = x[1]-x[0]  # uniform mesh
@@ -52,6 +67,11 @@ def solve_wg(x, n, lam, n_modes):
         integral = np.sum(modes[:, i])*delta_x
         modes[:, i] /= integral
 
+    # storing results, oldest solution is removed if cache is full
+    if len(_cache) >= _cache_maxsize:
+        del _cache[next(iter(_cache))]
+    _cache[key] = (n_eff.copy(), modes.copy())
+
     return n_eff, modes
 
 # example